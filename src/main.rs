@@ -2,34 +2,105 @@ use std::{
     fs,
     io::{self, Write},
     path::Path,
-    sync::atomic::{AtomicI64, AtomicU64, Ordering},
-    sync::Arc,
+    sync::atomic::{AtomicI64, AtomicU64, AtomicUsize, Ordering},
+    sync::{Arc, OnceLock},
     time::Duration,
 };
 
 use chrono::Utc;
 use colored::Colorize;
-use indicatif::{ProgressBar, ProgressStyle};
+use indicatif::{ProgressBar, ProgressDrawTarget, ProgressStyle};
 use num_format::{Locale, ToFormattedString};
-use sysinfo::{Pid, System};
-use tokio::{fs::File, io::AsyncWriteExt, io::BufWriter, sync::Mutex};
-use uuid::Uuid;
+use reqwest::{
+    header::{HeaderMap, CONTENT_LENGTH, CONTENT_RANGE, RANGE},
+    StatusCode,
+};
+use sysinfo::{Pid, ProcessesToUpdate, System};
+
+mod uring;
 
 const VERSION: &str = "3.1.0r";
 
+/// Chunks buffered between the network reader and the disk writer
+const STREAM_QUEUE_DEPTH: usize = 64;
+
+/// Progress redraws per second; indicatif's default of 20 competes with the
+/// downloads for the terminal
+const PROGRESS_REFRESH_HZ: u8 = 4;
+
+/// Counters shared by every download task; plain atomics so the hot path
+/// never waits on a lock
 #[derive(Debug, Default)]
 struct DownloadStats {
-    total_files: usize,
-    failed_downloads: usize,
-    total_bytes: u64,
-    start_time: Option<u64>,
+    total_files: AtomicUsize,
+    failed_downloads: AtomicUsize,
+    total_bytes: AtomicU64,
+    start_time: OnceLock<u64>,
+}
+
+#[derive(Debug, Default)]
+struct FreeBuffers {
+    buffers: Vec<Vec<u8>>,
+    idle_bytes: usize,
+}
+
+/// Body buffers kept across batches so steady-state downloads reuse
+/// already-faulted memory instead of allocating a fresh body each time.
+/// Nothing is kept until `start` sets the limits.
+#[derive(Debug, Default)]
+struct BufferPool {
+    free: std::sync::Mutex<FreeBuffers>,
+    max_buffers: AtomicUsize,
+    max_buffer_bytes: AtomicUsize,
+}
+
+impl BufferPool {
+    /// Keep up to `max_buffers` more idle buffers, none larger than
+    /// `max_buffer_bytes`
+    fn add_capacity(&self, max_buffers: usize, max_buffer_bytes: usize) {
+        self.max_buffers.fetch_add(max_buffers, Ordering::Relaxed);
+        self.max_buffer_bytes
+            .store(max_buffer_bytes, Ordering::Relaxed);
+    }
+
+    fn acquire(&self, capacity: usize) -> Vec<u8> {
+        let mut free = self.free.lock().unwrap();
+        let mut buffer = free.buffers.pop().unwrap_or_default();
+        free.idle_bytes -= buffer.capacity();
+        drop(free);
+        buffer.reserve(capacity);
+        buffer
+    }
+
+    fn release(&self, mut buffer: Vec<u8>) {
+        if buffer.capacity() > self.max_buffer_bytes.load(Ordering::Relaxed) {
+            return;
+        }
+        let mut free = self.free.lock().unwrap();
+        if free.buffers.len() >= self.max_buffers.load(Ordering::Relaxed) {
+            return;
+        }
+        buffer.clear();
+        free.idle_bytes += buffer.capacity();
+        free.buffers.push(buffer);
+    }
+
+    /// Memory held by buffers waiting in the pool
+    fn idle_bytes(&self) -> u64 {
+        self.free.lock().unwrap().idle_bytes as u64
+    }
 }
 
 struct Downloader {
     download_dir: String,
     max_memory_mb: AtomicU64,
-    stats: Arc<Mutex<DownloadStats>>,
+    stats: DownloadStats,
     last_end_time: AtomicI64,
+    buffers: BufferPool,
+    client: reqwest::Client,
+    discard: bool,
+    next_file_id: AtomicU64,
+    memory_usage: AtomicU64,
 }
 
 impl Downloader {
@@ -37,29 +108,63 @@ impl Downloader {
         let this = Downloader {
             download_dir: download_dir.unwrap_or_else(|| "downloads".to_string()),
             max_memory_mb: AtomicU64::new(max_memory_mb.unwrap_or(300)),
-            stats: Arc::new(Mutex::new(DownloadStats::default())),
+            stats: DownloadStats::default(),
             last_end_time: AtomicI64::new(-1),
+            buffers: BufferPool::default(),
+            client: Self::build_client(),
+            discard: std::env::var("AUTO_FAST_DL_DISCARD").is_ok_and(|v| v == "1"),
+            next_file_id: AtomicU64::new(0),
+            memory_usage: AtomicU64::new(0),
         };
         this.setup_download_dir();
         this
     }
 
+    /// One client for the whole process so keep-alive connections and TLS
+    /// sessions survive across batches and `start` calls. DNS goes through
+    /// hickory's async, TTL-caching resolver instead of `getaddrinfo` on the
+    /// blocking pool.
+    fn build_client() -> reqwest::Client {
+        reqwest::ClientBuilder::new()
+            .hickory_dns(true)
+            .pool_idle_timeout(Duration::from_secs(75))
+            .tcp_keepalive(Duration::from_secs(75))
+            .timeout(Duration::from_secs(30))
+            .build()
+            .expect("Failed to build HTTP client")
+    }
+
     fn setup_download_dir(&self) {
         if !Path::new(&self.download_dir).exists() {
             fs::create_dir_all(&self.download_dir).expect("Failed to create download directory");
         }
     }
 
-    /// Cleanup files in the download directory
-    pub fn cleanup_files(&self) {
-        let files = fs::read_dir(&self.download_dir).expect("Failed to read download directory");
-        for file in files {
-            let file = file.expect("Failed to read file");
-            let path = file.path();
-            if path.is_file() {
-                fs::remove_file(path).expect("Failed to remove file");
-            }
+    /// Cleanup files in the download directory on the blocking pool so the
+    /// sweep doesn't stall in-flight downloads
+    pub async fn cleanup_files(&self) {
+        if self.discard {
+            return;
         }
+        let download_dir = self.download_dir.clone();
+        tokio::task::spawn_blocking(move || {
+            let files = fs::read_dir(&download_dir).expect("Failed to read download directory");
+            for file in files {
+                let file = file.expect("Failed to read file");
+                // The file type comes from the directory listing, no stat needed
+                if !file.file_type().is_ok_and(|t| t.is_file()) {
+                    continue;
+                }
+                match fs::remove_file(file.path()) {
+                    Err(e) if e.kind() != io::ErrorKind::NotFound => {
+                        panic!("Failed to remove file: {e}")
+                    }
+                    _ => {}
+                }
+            }
+        })
+        .await
+        .expect("Failed to clean up download directory");
     }
 
     pub fn check_memory_availability(
@@ -80,16 +185,109 @@ impl Downloader {
         available_memory_mb > required_memory_mb
     }
 
-    fn get_memory_usage_mb(&self, system: &System) -> f64 {
-        let process = system.process(Pid::from_u32(std::process::id())).unwrap();
-        (process.memory() as f64) / 1024.0 / 1024.0
+    /// Sample this process's memory once per batch instead of on every download
+    fn refresh_memory_usage(&self, system: &mut System) {
+        let pid = Pid::from_u32(std::process::id());
+        system.refresh_processes(ProcessesToUpdate::Some(&[pid]), false);
+        if let Some(process) = system.process(pid) {
+            // Idle pooled buffers are reused before anything new is allocated,
+            // so they don't count against the memory budget
+            let memory = process.memory().saturating_sub(self.buffers.idle_bytes());
+            self.memory_usage.store(memory, Ordering::Relaxed);
+        }
+    }
+
+    fn get_memory_usage_mb(&self) -> f64 {
+        (self.memory_usage.load(Ordering::Relaxed) as f64) / 1024.0 / 1024.0
+    }
+
+    /// One-byte range request. Unlike HEAD it is answered by servers that
+    /// refuse HEAD. A 206 reply carries that single byte, but a server that
+    /// ignores the range answers 200 with the whole file.
+    fn range_probe(&self, url: &str) -> reqwest::RequestBuilder {
+        self.client.get(url).header(RANGE, "bytes=0-0")
+    }
+
+    /// Send one range probe, reading the byte of a 206 so its connection goes
+    /// back to the pool. `None` means the request failed.
+    async fn warm_up_probe(&self, url: &str) -> Option<StatusCode> {
+        let response = self.range_probe(url).send().await.ok()?;
+        let status = response.status();
+        if status == StatusCode::PARTIAL_CONTENT {
+            response.bytes().await.ok()?;
+        }
+        Some(status)
+    }
+
+    /// Open up to `count` pooled connections with concurrent range probes so
+    /// the first batch reuses established sockets instead of racing through
+    /// that many TCP and TLS handshakes. Failures only mean a colder start.
+    async fn warm_up_connections(&self, url: &str, count: usize) {
+        // Check with a single probe first: a server that ignores the range
+        // would start a whole-file transfer per probe, and dropping those
+        // closes the connections instead of pooling them
+        match self.warm_up_probe(url).await {
+            Some(StatusCode::PARTIAL_CONTENT) => {}
+            Some(StatusCode::OK) => {
+                println!("Connection warm-up skipped: server ignores Range");
+                return;
+            }
+            Some(status) => {
+                println!("Connection warm-up skipped: probe returned {status}");
+                return;
+            }
+            None => {
+                println!("Connection warm-up skipped: probe failed");
+                return;
+            }
+        }
+
+        // One of these reuses the checking probe's connection
+        let requests = (0..count).map(|_| self.warm_up_probe(url));
+        let warmed = futures::future::join_all(requests)
+            .await
+            .into_iter()
+            .filter(|status| *status == Some(StatusCode::PARTIAL_CONTENT))
+            .count();
+        println!("Connection warm-up: {warmed}/{count} connections ready");
+    }
+
+    /// Probe the file size with a one-byte range request
+    async fn get_file_size(&self, url: &str) -> anyhow::Result<u64> {
+        let response = self.range_probe(url).send().await?;
+        let status = response.status();
+        // 416 is what an empty file answers to `bytes=0-0`
+        if !status.is_success() && status != StatusCode::RANGE_NOT_SATISFIABLE {
+            return Err(anyhow::anyhow!("Size probe failed: {}", status));
+        }
+        let file_size = Self::parse_file_size(status, response.headers());
+        // Read the single byte so the connection goes back to the pool
+        if status == StatusCode::PARTIAL_CONTENT {
+            response.bytes().await?;
+        }
+        file_size
     }
 
-    async fn get_file_size(&self, client: &reqwest::Client, url: &str) -> anyhow::Result<u64> {
-        let response = client.head(url).send().await?;
-        let headers = response.headers();
+    /// Total file size from the headers of a range probe reply
+    fn parse_file_size(status: StatusCode, headers: &HeaderMap) -> anyhow::Result<u64> {
+        if let Some(content_range) = headers.get(CONTENT_RANGE) {
+            // Content-Range: bytes 0-0/<total>, or bytes */<total> on a 416
+            let total = content_range
+                .to_str()?
+                .rsplit_once('/')
+                .ok_or(anyhow::anyhow!("Malformed Content-Range"))?
+                .1;
+            return total
+                .parse::<u64>()
+                .map_err(|e| anyhow::anyhow!("Failed to parse Content-Range: {}", e));
+        }
+        if status != StatusCode::OK {
+            return Err(anyhow::anyhow!("Content-Range not provided"));
+        }
+
+        // The server ignored the range, so Content-Length covers the whole file
         let content_length = headers
-            .get("Content-Length")
+            .get(CONTENT_LENGTH)
             .ok_or(anyhow::anyhow!("Content-Length not provided"))?
             .to_str()?;
         content_length
@@ -97,30 +295,88 @@ impl Downloader {
             .map_err(|e| anyhow::anyhow!("Failed to parse Content-Length: {}", e))
     }
 
-    async fn save_to_disk(&self, content: &[u8], file_name: &str) -> anyhow::Result<()> {
-        let file_path = format!("{}/{}", self.download_dir, file_name);
-        let file = File::create(file_path).await?;
-        let mut writer = BufWriter::new(file);
-        writer.write_all(content).await?;
-        writer.flush().await?;
+    /// Consume the response body without keeping it, returning its size
+    async fn discard_content(mut response: reqwest::Response) -> reqwest::Result<u64> {
+        let mut len = 0;
+        while let Some(chunk) = response.chunk().await? {
+            len += chunk.len() as u64;
+        }
+        Ok(len)
+    }
+
+    /// Read the whole response body into a pooled buffer
+    async fn read_content(
+        mut response: reqwest::Response,
+        content: &mut Vec<u8>,
+    ) -> reqwest::Result<()> {
+        while let Some(chunk) = response.chunk().await? {
+            content.extend_from_slice(&chunk);
+        }
         Ok(())
     }
 
+    /// Write the body through io_uring from a single blocking task, handing
+    /// the buffer back for reuse
+    async fn save_to_disk(&self, mut content: Vec<u8>, file_path: &str) -> anyhow::Result<Vec<u8>> {
+        let file_path = file_path.to_string();
+        let content = tokio::task::spawn_blocking(move || {
+            uring::write_file(Path::new(&file_path), &mut content).map(|_| content)
+        })
+        .await??;
+        Ok(content)
+    }
+
+    /// Write the body to disk while it is still being received, so network
+    /// and disk time overlap instead of adding up
+    async fn stream_to_disk(
+        &self,
+        mut response: reqwest::Response,
+        file_path: &str,
+    ) -> anyhow::Result<u64> {
+        let (tx, mut rx) = tokio::sync::mpsc::channel(STREAM_QUEUE_DEPTH);
+        let path = file_path.to_string();
+        let writer =
+            tokio::task::spawn_blocking(move || uring::write_stream(Path::new(&path), &mut rx));
+
+        let received = loop {
+            match response.chunk().await {
+                // A closed channel means the writer failed; its error is reported below
+                Ok(Some(chunk)) => {
+                    if tx.send(chunk).await.is_err() {
+                        break Ok(());
+                    }
+                }
+                Ok(None) => break Ok(()),
+                Err(e) => break Err(e),
+            }
+        };
+        drop(tx);
+
+        let written = writer.await??;
+        received.map_err(|e| anyhow::anyhow!("Failed to read content: {}", e))?;
+        Ok(written)
+    }
+
+    fn fits_in_memory(&self, content_len: u64) -> bool {
+        let content_size_mb = content_len as f64 / 1024.0 / 1024.0;
+        let memory_usage_mb = self.get_memory_usage_mb();
+        memory_usage_mb + content_size_mb < self.max_memory_mb.load(Ordering::Relaxed) as f64
+    }
+
+    /// Download one file, returning the number of bytes received. Byte and
+    /// file totals are added by the caller as each download completes.
     pub async fn download_file(
         &self,
-        client: &reqwest::Client,
-        system: &System,
         url: &str,
         file_path: impl Into<String>,
         bar: ProgressBar,
-    ) -> anyhow::Result<()> {
+    ) -> anyhow::Result<u64> {
         let file_path = file_path.into();
-        let response = match client.get(url).send().await {
+        let response = match self.client.get(url).send().await {
             Ok(resp) => resp,
             Err(e) => {
                 eprintln!("Failed to download {}: {}", url, e);
-                let mut lock = self.stats.lock().await;
-                lock.failed_downloads += 1;
+                self.stats.failed_downloads.fetch_add(1, Ordering::Relaxed);
                 return Err(anyhow::anyhow!("Failed to download file"));
             }
         };
@@ -129,49 +385,71 @@ impl Downloader {
                 "Failed to download {url}, status code: {}",
                 response.status().as_str()
             );
-            let mut lock = self.stats.lock().await;
-            lock.failed_downloads += 1;
+            self.stats.failed_downloads.fetch_add(1, Ordering::Relaxed);
             return Err(anyhow::anyhow!("Failed to download file"));
         }
 
-        let content = match response.bytes().await {
-            Ok(bytes) => bytes,
-            Err(e) => {
-                eprintln!("Failed to read content from {}: {}", url, e);
-                let mut lock = self.stats.lock().await;
-                lock.failed_downloads += 1;
-                return Err(anyhow::anyhow!("Failed to read content"));
-            }
-        };
+        if self.discard {
+            let len = match Self::discard_content(response).await {
+                Ok(len) => len,
+                Err(e) => {
+                    eprintln!("Failed to read content from {}: {}", url, e);
+                    self.stats.failed_downloads.fetch_add(1, Ordering::Relaxed);
+                    return Err(anyhow::anyhow!("Failed to read content"));
+                }
+            };
+            bar.inc(1);
+            return Ok(len);
+        }
 
-        let content_size_mb = content.len() as f64 / 1024.0 / 1024.0;
-        let memory_usage_mb = self.get_memory_usage_mb(system);
-
-        if memory_usage_mb + content_size_mb < self.max_memory_mb.load(Ordering::Relaxed) as f64 {
-            let mut lock = self.stats.lock().await;
-            lock.total_bytes += content.len() as u64;
-        } else {
-            if let Err(e) = self.save_to_disk(&content, &file_path).await {
-                eprintln!("Failed to save {}: {}", file_path, e);
-                let mut lock = self.stats.lock().await;
-                lock.failed_downloads += 1;
-                return Err(anyhow::anyhow!("Failed to save file"));
-            }
-            let mut lock = self.stats.lock().await;
-            lock.total_bytes += content.len() as u64;
+        // Decide between memory and disk once: up front when the length is
+        // known, otherwise after the body has been buffered
+        let known_len = response.content_length();
+        if known_len.is_some_and(|len| !self.fits_in_memory(len)) {
+            let written = match self.stream_to_disk(response, &file_path).await {
+                Ok(written) => written,
+                Err(e) => {
+                    eprintln!("Failed to save {}: {}", file_path, e);
+                    self.stats.failed_downloads.fetch_add(1, Ordering::Relaxed);
+                    return Err(anyhow::anyhow!("Failed to save file"));
+                }
+            };
+            bar.inc(1);
+            return Ok(written);
         }
 
-        drop(content);
+        let mut content = self.buffers.acquire(known_len.unwrap_or(0) as usize);
+        if let Err(e) = Self::read_content(response, &mut content).await {
+            self.buffers.release(content);
+            eprintln!("Failed to read content from {}: {}", url, e);
+            self.stats.failed_downloads.fetch_add(1, Ordering::Relaxed);
+            return Err(anyhow::anyhow!("Failed to read content"));
+        }
+
+        let content_len = content.len() as u64;
+
+        if known_len.is_none() && !self.fits_in_memory(content_len) {
+            content = match self.save_to_disk(content, &file_path).await {
+                Ok(content) => content,
+                Err(e) => {
+                    eprintln!("Failed to save {}: {}", file_path, e);
+                    self.stats.failed_downloads.fetch_add(1, Ordering::Relaxed);
+                    return Err(anyhow::anyhow!("Failed to save file"));
+                }
+            };
+        }
+        self.buffers.release(content);
 
         bar.inc(1);
 
-        Ok(())
+        Ok(content_len)
     }
 
     pub async fn display_completion_banner(&self) {
-        let lock = self.stats.lock().await;
-        let gb_downloaded = lock.total_bytes as f64 / (1024.0 * 1024.0 * 1024.0);
-        let total_time = Utc::now().timestamp() as u64 - lock.start_time.unwrap_or(0);
+        let total_bytes = self.stats.total_bytes.load(Ordering::Relaxed);
+        let gb_downloaded = total_bytes as f64 / (1024.0 * 1024.0 * 1024.0);
+        let start_time = self.stats.start_time.get().copied().unwrap_or(0);
+        let total_time = Utc::now().timestamp() as u64 - start_time;
         let completion_banner = format!(
             "╔══════════════════ Download Complete ══════════════════╗
 ║                                                       ║
@@ -184,15 +462,28 @@ impl Downloader {
 ║  🎉 Download Session Completed Successfully! 🎉       ║
 ║                                                       ║
 ╚═══════════════════════════════════════════════════════╝",
-            lock.total_files.to_formatted_string(&Locale::en),
-            lock.failed_downloads.to_formatted_string(&Locale::en),
+            self.stats
+                .total_files
+                .load(Ordering::Relaxed)
+                .to_formatted_string(&Locale::en),
+            self.stats
+                .failed_downloads
+                .load(Ordering::Relaxed)
+                .to_formatted_string(&Locale::en),
             format!("{:.2} GB", gb_downloaded),
             format!("{:.2} seconds", total_time)
         );
         println!("{}", completion_banner.green());
     }
 
-    pub async fn start(&self, url: &str, batch_size: Option<usize>) -> anyhow::Result<()> {
+    /// Run batches until Ctrl+C. Each download is spawned as its own task so
+    /// the multi-threaded runtime spreads a batch across all worker threads
+    /// instead of polling it from this one task.
+    pub async fn start(
+        self: Arc<Self>,
+        url: &str,
+        batch_size: Option<usize>,
+    ) -> anyhow::Result<()> {
         let batch_size = batch_size.unwrap_or(20);
         if !url.starts_with("http://") && !url.starts_with("https://") {
             eprintln!(
@@ -201,8 +492,7 @@ impl Downloader {
             return Err(anyhow::anyhow!("Invalid URL"));
         }
 
-        let client = reqwest::Client::new();
-        let file_size = self.get_file_size(&client, url).await?;
+        let file_size = self.get_file_size(url).await?;
         let file_size_mb = file_size as f64 / 1024.0 / 1024.0;
 
         let mut system = System::new_all();
@@ -211,6 +501,10 @@ impl Downloader {
         let safe_batch_size = std::cmp::max(1, (available_memory_mb / file_size_mb * 2.0) as usize);
         let actual_batch_size = std::cmp::min(batch_size, safe_batch_size);
 
+        if self.discard {
+            println!("\nDiscard mode: response bodies are counted and dropped");
+        }
+
         println!("\nAdjusted batch size to {actual_batch_size} based on available memory");
 
         if !self.check_memory_availability(&system, actual_batch_size, file_size_mb) {
@@ -218,17 +512,25 @@ impl Downloader {
             self.max_memory_mb.store(0, Ordering::Relaxed);
         }
 
-        let client = reqwest::ClientBuilder::new()
-            .pool_max_idle_per_host(actual_batch_size)
-            .timeout(Duration::from_secs(30))
-            .build()?;
+        let max_buffer_bytes = self.max_memory_mb.load(Ordering::Relaxed) as usize * 1024 * 1024;
+        self.buffers
+            .add_capacity(actual_batch_size, max_buffer_bytes);
+
+        self.warm_up_connections(url, actual_batch_size).await;
 
         let download_dir = self.download_dir.clone();
-        let mut lock = self.stats.lock().await;
-        if lock.start_time.is_none() {
-            lock.start_time = Some(Utc::now().timestamp() as u64);
-        }
-        drop(lock);
+        let pid = std::process::id();
+        let shared_url: Arc<str> = Arc::from(url);
+        self.stats
+            .start_time
+            .get_or_init(|| Utc::now().timestamp() as u64);
+
+        let bar_style = ProgressStyle::default_bar()
+            .template(
+                "{spinner:.green} [{elapsed_precise}] [{wide_bar:.cyan/blue}] {pos}/{len} ({eta})",
+            )
+            .unwrap()
+            .progress_chars("#>-");
 
         let ctrl_c = tokio::signal::ctrl_c();
         tokio::pin!(ctrl_c);
@@ -241,31 +543,46 @@ impl Downloader {
                 }
                 _ = tokio::time::sleep(Duration::from_secs(1)) => {
                     let batch_start_time = Utc::now().timestamp() as u64;
-                    let mut tasks = Vec::with_capacity(actual_batch_size);
-                    let bar = ProgressBar::new(actual_batch_size as u64);
-                    bar.set_style(
-                        ProgressStyle::default_bar()
-                            .template("{spinner:.green} [{elapsed_precise}] [{wide_bar:.cyan/blue}] {pos}/{len} ({eta})")
-                            .unwrap()
-                            .progress_chars("#>-"),
-                    );
+                    self.refresh_memory_usage(&mut system);
+                    let mut tasks = tokio::task::JoinSet::new();
+                    let bar = ProgressBar::with_draw_target(
+                        Some(actual_batch_size as u64),
+                        ProgressDrawTarget::stderr_with_hz(PROGRESS_REFRESH_HZ),
+                    )
+                    .with_style(bar_style.clone());
 
                     bar.tick();
 
                     for _ in 0..actual_batch_size {
-                        let file_name = format!("{}.dat", Uuid::new_v4());
+                        let file_id = self.next_file_id.fetch_add(1, Ordering::Relaxed);
+                        let file_name = format!("{pid}_{file_id}.dat");
                         let file_path = Path::new(&download_dir).join(file_name);
                         let file_path = file_path.to_str().unwrap().to_string();
-                        let d = self.download_file(&client, &system, url, file_path, bar.clone());
-                        tasks.push(d);
+                        let downloader = Arc::clone(&self);
+                        let url = Arc::clone(&shared_url);
+                        let bar = bar.clone();
+                        tasks.spawn(async move { downloader.download_file(&url, file_path, bar).await });
                     }
 
-                    let results = futures::future::join_all(tasks).await;
-
-                    let successful_downloads = results.iter().filter(|&result| result.is_ok()).count();
-                    let mut lock = self.stats.lock().await;
-                    lock.total_files += successful_downloads;
-                    drop(lock);
+                    // Account for each download as soon as it finishes rather than
+                    // waiting on the slowest one in the batch
+                    while let Some(result) = tasks.join_next().await {
+                        match result {
+                            Ok(Ok(bytes)) => {
+                                self.stats.total_files.fetch_add(1, Ordering::Relaxed);
+                                self.stats.total_bytes.fetch_add(bytes, Ordering::Relaxed);
+                            }
+                            // Already counted as failed by download_file
+                            Ok(Err(_)) => {}
+                            Err(e) => {
+                                self.stats.failed_downloads.fetch_add(1, Ordering::Relaxed);
+                                if e.is_panic() {
+                                    std::panic::resume_unwind(e.into_panic());
+                                }
+                                eprintln!("Download task failed: {}", e);
+                            }
+                        }
+                    }
 
                     bar.finish();
 
@@ -283,7 +600,7 @@ impl Downloader {
                     println!("\n{actual_batch_size} files downloaded in {elapsed_time:.2} seconds, ");
                     println!("average speed: {avg_speed:.2} files/second");
 
-                    self.cleanup_files();
+                    self.cleanup_files().await;
                 }
             }
         }
@@ -294,14 +611,16 @@ impl Downloader {
 
 async fn handle_exit(downloader: &Downloader) {
     println!("\nComplete!");
-    let s = downloader.stats.lock().await;
-    println!("Total files downloaded: {}", s.total_files);
+    let s = &downloader.stats;
+    println!(
+        "Total files downloaded: {}",
+        s.total_files.load(Ordering::Relaxed)
+    );
     println!(
         "Total data downloaded: {:.2} GB",
-        s.total_bytes as f64 / 1024.0 / 1024.0 / 1024.0
+        s.total_bytes.load(Ordering::Relaxed) as f64 / 1024.0 / 1024.0 / 1024.0
     );
-    drop(s);
-    downloader.cleanup_files();
+    downloader.cleanup_files().await;
     downloader.display_completion_banner().await;
     std::process::exit(0);
 }
@@ -0,0 +1,576 @@
+//! io_uring backed file writes for the disk path.
+//!
+//! Each blocking-pool thread lazily owns one ring. A body is split into
+//! segments that are all queued before a single `io_uring_enter`, so a large
+//! file costs one thread hop and a handful of syscalls instead of one write
+//! per buffered chunk. Streamed bodies, the large ones that miss the memory
+//! budget, are written while still arriving and opened with `O_DIRECT` so
+//! they skip the page cache, falling back to buffered writes where the
+//! filesystem refuses it. Kernels without `IORING_OP_WRITE` (< 5.6) and
+//! other platforms fall back to plain buffered writes.
+
+#[cfg(target_os = "linux")]
+pub use linux::{write_file, write_stream};
+
+#[cfg(not(target_os = "linux"))]
+pub fn write_file(path: &std::path::Path, content: &mut Vec<u8>) -> std::io::Result<()> {
+    std::fs::write(path, &content[..])
+}
+
+#[cfg(not(target_os = "linux"))]
+pub fn write_stream(
+    path: &std::path::Path,
+    chunks: &mut tokio::sync::mpsc::Receiver<bytes::Bytes>,
+) -> std::io::Result<u64> {
+    use std::io::Write;
+
+    let mut file = std::fs::File::create(path)?;
+    let mut written = 0;
+    while let Some(chunk) = chunks.blocking_recv() {
+        file.write_all(&chunk)?;
+        written += chunk.len() as u64;
+    }
+    Ok(written)
+}
+
+#[cfg(target_os = "linux")]
+mod linux {
+    use std::{
+        cell::RefCell,
+        fs::{File, OpenOptions},
+        io::{self, Write},
+        os::{
+            fd::{AsRawFd, RawFd},
+            unix::fs::{FileExt, OpenOptionsExt},
+        },
+        path::Path,
+        sync::atomic::{AtomicBool, Ordering},
+    };
+
+    use bytes::Bytes;
+    use io_uring::{opcode, types, IoUring, Probe};
+    use tokio::sync::mpsc::Receiver;
+
+    const RING_ENTRIES: u32 = 32;
+    const SEGMENT_SIZE: usize = 1024 * 1024;
+
+    /// Alignment and size granularity for `O_DIRECT`; 4 KiB covers both 512 B
+    /// and 4 KiB logical block sizes
+    const BLOCK_SIZE: usize = 4096;
+    const DIRECT_STAGING_SIZE: usize = 4 * 1024 * 1024;
+
+    #[derive(Clone, Copy)]
+    #[repr(C, align(4096))]
+    struct Block([u8; BLOCK_SIZE]);
+
+    /// Block-aligned buffer that streamed chunks are copied into before an
+    /// `O_DIRECT` write
+    struct Staging {
+        blocks: Vec<Block>,
+        len: usize,
+    }
+
+    impl Staging {
+        fn new(size: usize) -> Self {
+            Staging {
+                blocks: vec![Block([0; BLOCK_SIZE]); size / BLOCK_SIZE],
+                len: 0,
+            }
+        }
+
+        fn capacity(&self) -> usize {
+            self.blocks.len() * BLOCK_SIZE
+        }
+
+        fn as_bytes(&self) -> &[u8] {
+            // SAFETY: `Block` is plain bytes with no padding, so the blocks form
+            // one contiguous byte slice
+            unsafe { std::slice::from_raw_parts(self.blocks.as_ptr().cast(), self.capacity()) }
+        }
+
+        fn as_bytes_mut(&mut self) -> &mut [u8] {
+            let capacity = self.capacity();
+            // SAFETY: see `as_bytes`
+            unsafe { std::slice::from_raw_parts_mut(self.blocks.as_mut_ptr().cast(), capacity) }
+        }
+
+        /// Copy as much of `data` as fits, returning the number of bytes taken
+        fn fill(&mut self, data: &[u8]) -> usize {
+            let start = self.len;
+            let taken = data.len().min(self.capacity() - start);
+            self.as_bytes_mut()[start..start + taken].copy_from_slice(&data[..taken]);
+            self.len += taken;
+            taken
+        }
+    }
+
+    static UNSUPPORTED: AtomicBool = AtomicBool::new(false);
+
+    thread_local! {
+        static RING: RefCell<Option<IoUring>> = const { RefCell::new(None) };
+    }
+
+    fn new_ring() -> io::Result<IoUring> {
+        let ring = IoUring::new(RING_ENTRIES)?;
+        let mut probe = Probe::new();
+        ring.submitter().register_probe(&mut probe)?;
+        if !probe.is_supported(opcode::Write::CODE) {
+            return Err(io::Error::new(
+                io::ErrorKind::Unsupported,
+                "IORING_OP_WRITE not supported",
+            ));
+        }
+        Ok(ring)
+    }
+
+    /// Run `f` with this thread's ring, created on first use. The slot is
+    /// left empty when io_uring is unavailable.
+    fn with_ring<T>(f: impl FnOnce(&mut Option<IoUring>) -> T) -> T {
+        RING.with(|cell| {
+            let mut slot = cell.borrow_mut();
+            if slot.is_none() && !UNSUPPORTED.load(Ordering::Relaxed) {
+                match new_ring() {
+                    Ok(ring) => *slot = Some(ring),
+                    Err(_) => UNSUPPORTED.store(true, Ordering::Relaxed),
+                }
+            }
+            f(&mut slot)
+        })
+    }
+
+    /// Write `content` to `path` through this thread's ring
+    ///
+    /// If the ring fails while writes are still in flight the buffer is leaked
+    /// (leaving `content` empty) so the kernel never writes from freed memory.
+    pub fn write_file(path: &Path, content: &mut Vec<u8>) -> io::Result<()> {
+        let mut file = File::create(path)?;
+        with_ring(|slot| {
+            let Some(ring) = slot else {
+                return file.write_all(content);
+            };
+            submit_writes(ring, file.as_raw_fd(), std::slice::from_ref(content), 0, 1).map_err(
+                |(e, in_flight)| {
+                    if in_flight {
+                        std::mem::forget(std::mem::take(content));
+                        *slot = None;
+                    }
+                    e
+                },
+            )
+        })
+    }
+
+    /// Write chunks to `path` as they arrive, bypassing the page cache with
+    /// `O_DIRECT` where the filesystem allows it. Returns the number of bytes
+    /// written.
+    pub fn write_stream(path: &Path, chunks: &mut Receiver<Bytes>) -> io::Result<u64> {
+        let direct = OpenOptions::new()
+            .write(true)
+            .create(true)
+            .truncate(true)
+            .custom_flags(libc::O_DIRECT)
+            .open(path);
+        match direct {
+            Ok(file) => write_stream_direct(file, chunks),
+            // Filesystems without O_DIRECT support (e.g. tmpfs) reject the flag
+            Err(e) if e.raw_os_error() == Some(libc::EINVAL) => {
+                write_stream_buffered(File::create(path)?, chunks)
+            }
+            Err(e) => Err(e),
+        }
+    }
+
+    /// Copy chunks into an aligned staging buffer and write it out a whole
+    /// buffer at a time. The tail is padded to a block and trimmed afterwards.
+    fn write_stream_direct(file: File, chunks: &mut Receiver<Bytes>) -> io::Result<u64> {
+        let mut staging = Staging::new(DIRECT_STAGING_SIZE);
+        let mut written = 0;
+        while let Some(chunk) = chunks.blocking_recv() {
+            let mut rest = &chunk[..];
+            while !rest.is_empty() {
+                rest = &rest[staging.fill(rest)..];
+                if staging.len == staging.capacity() {
+                    let len = staging.len;
+                    write_staged(&file, &mut staging, len, written)?;
+                    written += len as u64;
+                    staging.len = 0;
+                }
+            }
+        }
+        if staging.len > 0 {
+            let tail = staging.len;
+            write_staged(
+                &file,
+                &mut staging,
+                tail.next_multiple_of(BLOCK_SIZE),
+                written,
+            )?;
+            written += tail as u64;
+            file.set_len(written)?;
+        }
+        Ok(written)
+    }
+
+    /// Write the first `len` bytes of `staging` at `offset`; both must be
+    /// block aligned
+    fn write_staged(file: &File, staging: &mut Staging, len: usize, offset: u64) -> io::Result<()> {
+        with_ring(|slot| {
+            let Some(ring) = slot else {
+                return write_all_at_aligned(file, &staging.as_bytes()[..len], offset, BLOCK_SIZE);
+            };
+            let data = [&staging.as_bytes()[..len]];
+            submit_writes(ring, file.as_raw_fd(), &data, offset, BLOCK_SIZE).map_err(
+                |(e, in_flight)| {
+                    if in_flight {
+                        std::mem::forget(std::mem::take(&mut staging.blocks));
+                        *slot = None;
+                    }
+                    e
+                },
+            )
+        })
+    }
+
+    /// `write_all_at` that resumes a short write from the last multiple of
+    /// `align` it reached, like `submit_writes`
+    fn write_all_at_aligned(
+        file: &File,
+        mut data: &[u8],
+        mut offset: u64,
+        align: usize,
+    ) -> io::Result<()> {
+        while !data.is_empty() {
+            let done = match file.write_at(data, offset) {
+                Ok(done) if done == data.len() => done,
+                Ok(done) => done - done % align,
+                Err(e) if e.kind() == io::ErrorKind::Interrupted => continue,
+                Err(e) => return Err(e),
+            };
+            if done == 0 {
+                return Err(io::Error::from(io::ErrorKind::WriteZero));
+            }
+            data = &data[done..];
+            offset += done as u64;
+        }
+        Ok(())
+    }
+
+    /// Write chunks through the page cache, submitting everything already
+    /// queued in one go
+    fn write_stream_buffered(mut file: File, chunks: &mut Receiver<Bytes>) -> io::Result<u64> {
+        let mut written = 0;
+        let mut batch = Vec::with_capacity(RING_ENTRIES as usize);
+        while let Some(chunk) = chunks.blocking_recv() {
+            batch.push(chunk);
+            while batch.len() < RING_ENTRIES as usize {
+                match chunks.try_recv() {
+                    Ok(chunk) => batch.push(chunk),
+                    Err(_) => break,
+                }
+            }
+            let batch_len: u64 = batch.iter().map(|chunk| chunk.len() as u64).sum();
+            with_ring(|slot| {
+                let Some(ring) = slot else {
+                    return batch.iter().try_for_each(|chunk| file.write_all(chunk));
+                };
+                submit_writes(ring, file.as_raw_fd(), &batch, written, 1).map_err(
+                    |(e, in_flight)| {
+                        if in_flight {
+                            std::mem::forget(std::mem::take(&mut batch));
+                            *slot = None;
+                        }
+                        e
+                    },
+                )
+            })?;
+            written += batch_len;
+            batch.clear();
+        }
+        Ok(written)
+    }
+
+    /// Queue every buffer as contiguous writes starting at `offset`, then reap
+    /// completions until all bytes are written. A short write is resumed from
+    /// the last multiple of `align` it reached, since `O_DIRECT` rejects
+    /// unaligned buffers and offsets; rewriting the bytes past that point is
+    /// harmless. At most `RING_ENTRIES` writes are in flight at once, so their
+    /// completions always fit the completion queue. The error flag reports
+    /// whether writes were still in flight.
+    fn submit_writes<B: AsRef<[u8]>>(
+        ring: &mut IoUring,
+        fd: RawFd,
+        buffers: &[B],
+        offset: u64,
+        align: usize,
+    ) -> Result<(), (io::Error, bool)> {
+        let mut segments: Vec<(&[u8], u64)> = Vec::new();
+        let mut position = offset;
+        for buffer in buffers {
+            for piece in buffer.as_ref().chunks(SEGMENT_SIZE) {
+                segments.push((piece, position));
+                position += piece.len() as u64;
+            }
+        }
+        let mut queued: Vec<usize> = (0..segments.len()).rev().collect();
+        let mut in_flight = 0;
+        let mut error = None;
+
+        while in_flight > 0 || (error.is_none() && !queued.is_empty()) {
+            while error.is_none() && in_flight < RING_ENTRIES {
+                let Some(&index) = queued.last() else { break };
+                let (piece, position) = segments[index];
+                let entry = opcode::Write::new(types::Fd(fd), piece.as_ptr(), piece.len() as u32)
+                    .offset(position)
+                    .build()
+                    .user_data(index as u64);
+                // SAFETY: the buffers outlive the write; every submission is reaped
+                // before returning, or the buffers are leaked by the caller.
+                if unsafe { ring.submission().push(&entry) }.is_err() {
+                    break;
+                }
+                queued.pop();
+                in_flight += 1;
+            }
+
+            if let Err(e) = ring.submit_and_wait(1) {
+                match e.raw_os_error() {
+                    // EBUSY means completions are waiting to be reaped, so drain
+                    // the queue below before trying again
+                    Some(libc::EINTR | libc::EAGAIN | libc::EBUSY) => {}
+                    _ => return Err((e, in_flight > 0)),
+                }
+            }
+
+            let completed: Vec<(u64, i32)> = ring
+                .completion()
+                .map(|cqe| (cqe.user_data(), cqe.result()))
+                .collect();
+            for (index, result) in completed {
+                in_flight -= 1;
+                let index = index as usize;
+                let (piece, position) = &mut segments[index];
+                let done = match usize::try_from(result) {
+                    Ok(done) if done == piece.len() => done,
+                    Ok(done) => done - done % align,
+                    Err(_) => {
+                        error.get_or_insert(io::Error::from_raw_os_error(-result));
+                        continue;
+                    }
+                };
+                if done == 0 {
+                    error.get_or_insert(io::Error::from(io::ErrorKind::WriteZero));
+                    continue;
+                }
+                *piece = &piece[done..];
+                *position += done as u64;
+                if !piece.is_empty() {
+                    queued.push(index);
+                }
+            }
+        }
+
+        match error {
+            Some(e) => Err((e, false)),
+            None => Ok(()),
+        }
+    }
+
+    #[cfg(test)]
+    mod tests {
+        use std::{fs, path::PathBuf};
+
+        use super::*;
+
+        const MIB: usize = 1024 * 1024;
+        const SIZES: [usize; 6] = [0, 100, 4096, 8192, 4 * MIB, 9 * MIB + 1234];
+
+        fn pattern(len: usize) -> Vec<u8> {
+            (0..len).map(|i| (i % 251) as u8).collect()
+        }
+
+        fn file_name(name: &str) -> String {
+            format!("auto-fast-dl-{}-{name}", std::process::id())
+        }
+
+        fn temp_path(name: &str) -> PathBuf {
+            std::env::temp_dir().join(file_name(name))
+        }
+
+        fn open_direct(path: &Path) -> io::Result<File> {
+            OpenOptions::new()
+                .write(true)
+                .create(true)
+                .truncate(true)
+                .custom_flags(libc::O_DIRECT)
+                .open(path)
+        }
+
+        /// Path on a filesystem that accepts `O_DIRECT`. tmpfs doesn't, so the
+        /// directory holding the test binary, wherever the target dir is, is
+        /// tried next.
+        fn direct_path(name: &str) -> Option<PathBuf> {
+            let exe_dir = std::env::current_exe()
+                .ok()
+                .and_then(|exe| exe.parent().map(Path::to_path_buf));
+            [Some(std::env::temp_dir()), exe_dir]
+                .into_iter()
+                .flatten()
+                .map(|dir| dir.join(file_name(name)))
+                .find(|path| {
+                    let direct = open_direct(path);
+                    let _ = fs::remove_file(path);
+                    direct.is_ok()
+                })
+        }
+
+        /// Feed `data` through a channel in odd-sized chunks, the way
+        /// `stream_to_disk` does
+        fn stream(data: &[u8]) -> Receiver<Bytes> {
+            let (sender, receiver) = tokio::sync::mpsc::channel(64);
+            let data = Bytes::copy_from_slice(data);
+            std::thread::spawn(move || {
+                let mut start = 0;
+                while start < data.len() {
+                    let end = (start + 7919).min(data.len());
+                    sender.blocking_send(data.slice(start..end)).unwrap();
+                    start = end;
+                }
+            });
+            receiver
+        }
+
+        /// io_uring is often blocked in CI sandboxes (Docker's default seccomp
+        /// profile, gVisor); there is nothing to test then
+        fn ring_enabled() -> bool {
+            let enabled = with_ring(|slot| slot.is_some());
+            if !enabled {
+                eprintln!("skipping: io_uring is not available");
+            }
+            enabled
+        }
+
+        #[test]
+        fn write_file_round_trips() {
+            if !ring_enabled() {
+                return;
+            }
+            for size in SIZES {
+                let path = temp_path(&format!("file-{size}"));
+                let data = pattern(size);
+                let mut content = data.clone();
+                write_file(&path, &mut content).unwrap();
+                assert_eq!(content, data, "buffer changed, size {size}");
+                assert!(fs::read(&path).unwrap() == data, "size {size}");
+                fs::remove_file(&path).unwrap();
+            }
+        }
+
+        #[test]
+        fn write_file_round_trips_past_completion_queue_size() {
+            if !ring_enabled() {
+                return;
+            }
+            // More segments than the completion queue holds (twice the ring size)
+            let size = (2 * RING_ENTRIES as usize + 8) * SEGMENT_SIZE + 1234;
+            let path = temp_path("file-many-segments");
+            let data = pattern(size);
+            let mut content = data.clone();
+            write_file(&path, &mut content).unwrap();
+            assert!(fs::read(&path).unwrap() == data);
+            fs::remove_file(&path).unwrap();
+        }
+
+        #[test]
+        fn write_stream_direct_round_trips() {
+            if !ring_enabled() {
+                return;
+            }
+            for size in SIZES {
+                let Some(path) = direct_path(&format!("direct-{size}")) else {
+                    eprintln!("skipping: no directory accepts O_DIRECT");
+                    return;
+                };
+                let file = open_direct(&path).unwrap();
+                let data = pattern(size);
+                let written = write_stream_direct(file, &mut stream(&data)).unwrap();
+                assert_eq!(written, size as u64);
+                assert!(fs::read(&path).unwrap() == data, "size {size}");
+                fs::remove_file(&path).unwrap();
+            }
+        }
+
+        #[test]
+        fn write_all_at_aligned_round_trips() {
+            let Some(path) = direct_path("aligned") else {
+                eprintln!("skipping: no directory accepts O_DIRECT");
+                return;
+            };
+            let file = open_direct(&path).unwrap();
+            let data = pattern(2 * DIRECT_STAGING_SIZE + 100);
+            let mut staging = Staging::new(DIRECT_STAGING_SIZE);
+            let mut written = 0;
+            for piece in data.chunks(DIRECT_STAGING_SIZE) {
+                staging.len = 0;
+                staging.fill(piece);
+                let len = piece.len().next_multiple_of(BLOCK_SIZE);
+                write_all_at_aligned(&file, &staging.as_bytes()[..len], written, BLOCK_SIZE)
+                    .unwrap();
+                written += piece.len() as u64;
+            }
+            file.set_len(written).unwrap();
+            assert!(fs::read(&path).unwrap() == data);
+            fs::remove_file(&path).unwrap();
+        }
+
+        #[test]
+        fn write_stream_round_trips() {
+            if !ring_enabled() {
+                return;
+            }
+            for size in SIZES {
+                // Without O_DIRECT support this covers the buffered fallback
+                let name = format!("stream-{size}");
+                let path = direct_path(&name).unwrap_or_else(|| temp_path(&name));
+                let data = pattern(size);
+                let written = write_stream(&path, &mut stream(&data)).unwrap();
+                assert_eq!(written, size as u64);
+                assert!(fs::read(&path).unwrap() == data, "size {size}");
+                fs::remove_file(&path).unwrap();
+            }
+        }
+
+        #[test]
+        fn write_stream_buffered_round_trips() {
+            if !ring_enabled() {
+                return;
+            }
+            for size in SIZES {
+                let path = temp_path(&format!("buffered-{size}"));
+                let data = pattern(size);
+                let file = File::create(&path).unwrap();
+                let written = write_stream_buffered(file, &mut stream(&data)).unwrap();
+                assert_eq!(written, size as u64);
+                assert!(fs::read(&path).unwrap() == data, "size {size}");
+                fs::remove_file(&path).unwrap();
+            }
+        }
+
+        #[test]
+        fn completion_errors_are_reaped_before_returning() {
+            if !ring_enabled() {
+                return;
+            }
+            let path = temp_path("read-only");
+            fs::write(&path, b"").unwrap();
+            let file = File::open(&path).unwrap();
+            let data = pattern(3 * SEGMENT_SIZE);
+            let (error, in_flight) = with_ring(|slot| {
+                submit_writes(slot.as_mut().unwrap(), file.as_raw_fd(), &[&data[..]], 0, 1)
+            })
+            .unwrap_err();
+            assert_eq!(error.raw_os_error(), Some(libc::EBADF));
+            assert!(!in_flight, "writes were left in flight");
+            fs::remove_file(&path).unwrap();
+        }
+    }
+}